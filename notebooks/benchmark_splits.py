@@ -0,0 +1,128 @@
+# %% [markdown]
+# # Benchmark Splits
+#
+# Check the per-track splits against hand-computed values,
+# then time the stream join on a multi-hour activity.
+
+# %%
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "src"))
+from tracklists import get_splits, get_tracklist, paused, preprocess_streams
+
+
+START = pd.Timestamp("2026-10-01 06:00", tz="UTC")
+
+
+def make_activity(seconds):
+    return pd.Series({"start": START, "end": START + pd.Timedelta(seconds=seconds)})
+
+
+def make_tracks(starts, ends):
+    return pd.DataFrame({
+        "start": START + pd.to_timedelta(starts, unit="s"),
+        "end": START + pd.to_timedelta(ends, unit="s"),
+        "track_name": [f"track {i}" for i in range(len(starts))],
+        "artist": "artist",
+        "id": range(len(starts)),
+    })
+
+
+# %% [markdown]
+# # Check
+# Samples every 10 s at 4 m/s (pace 4:10 /km), heart rate rising by 10 bpm per sample.
+
+# %%
+streams = pd.DataFrame({
+    "time": [0, 10, 20, 30, 40, 50, 60],
+    "distance": [0, 40, 80, 120, 160, 200, 240],
+    "heartrate": [100, 110, 120, 130, 140, 150, 160],
+})
+activity = make_activity(60)
+tracks = make_tracks(
+    starts=[0, 12, -120, 100],     # full split, shorter than sampling interval, before, after
+    ends=[30, 18, -60, 160],
+)
+splits = get_splits(activity, tracks, streams)
+
+# samples 0-3
+assert splits.loc[0, "start_km"] == 0.0 and splits.loc[0, "end_km"] == 0.12
+assert splits.loc[0, "pace"] == 250     # 30 s over 120 m, in seconds per km
+assert splits.loc[0, "heartrate"] == 115
+
+# no sample falls inside 12-18 s, so first and last both resolve to sample 2,
+# the first at or after the track start: position but no pace
+assert splits.loc[1, "start_km"] == splits.loc[1, "end_km"] == 0.08
+assert np.isnan(splits.loc[1, "pace"])
+assert splits.loc[1, "heartrate"] == 120
+
+# no samples before or after the activity
+assert splits.loc[[2, 3]].isna().all().all()
+
+assert get_tracklist(activity, tracks, streams) == [
+    "track 0 - artist (0.12 km at km 0.0, 4:10 /km, 115 bpm)",
+    "track 1 - artist (0.00 km at km 0.1, 120 bpm)",
+    "track 2 - artist",     # matched through the overlap tolerance only
+    "track 3 - artist",
+]
+
+# a heart rate dropout only affects the tracks it falls in
+dropout = preprocess_streams({
+    "time": {"data": [0, 10, 20, 30, 40, 50, 60]},
+    "heartrate": {"data": [None, 110, 120, 130, 140, 150, 160]},
+})
+splits = get_splits(activity, make_tracks(starts=[0, 30], ends=[20, 60]), dropout)
+assert splits["heartrate"].to_list() == [115, 145]
+
+# a paused recording leaves a gap in the time stream, tracks inside it are dropped
+gap = pd.DataFrame({
+    "time": [0, 10, 20, 620, 630, 640],
+    "distance": [0, 40, 80, 80, 120, 160],
+})
+tracks = make_tracks(starts=[100, 10], ends=[400, 630])
+assert paused(make_activity(640), tracks, gap).tolist() == [True, False]
+
+# pace over moving time only: 80 m in 20 s, not the 620 s elapsed
+assert get_splits(make_activity(640), tracks, gap).loc[1, "pace"] == 250
+
+# with a moving stream, a gap while still moving is not a pause: 180 m in 60 s
+smart_recording = pd.DataFrame({
+    "time": [0, 10, 20, 60, 70],
+    "distance": [0, 30, 60, 180, 210],
+    "moving": True,
+})
+tracks = make_tracks(starts=[25, 10], ends=[55, 70])
+assert not paused(make_activity(70), tracks, smart_recording).any()
+assert round(get_splits(make_activity(70), tracks, smart_recording).loc[1, "pace"]) == 333
+print("Checks passed.")
+
+
+# %% [markdown]
+# # Benchmark
+# A 6 h activity sampled at 1 Hz (21,600 samples), with a track every 200 s.
+
+# %%
+def benchmark(fn, repeat=20):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - start) / repeat * 1000
+
+
+seconds = 6 * 3600
+streams = pd.DataFrame({
+    "time": np.arange(seconds),
+    "distance": np.arange(seconds) * 3.0,
+    "heartrate": 140 + np.random.default_rng(0).random(seconds) * 20,
+})
+activity = make_activity(seconds)
+tracks = make_tracks(starts=np.arange(0, seconds, 200), ends=np.arange(200, seconds + 200, 200))
+
+print(f"{len(streams)} samples, {len(tracks)} tracks")
+print(f"get_splits:    {benchmark(lambda: get_splits(activity, tracks, streams)):.1f} ms")
+print(f"get_tracklist: {benchmark(lambda: get_tracklist(activity, tracks, streams)):.1f} ms")
@@ -1,7 +1,10 @@
 import datetime as dt
+import gzip
 import json
 import os 
+import tempfile
 import requests as r 
+import numpy as np
 import pandas as pd
 
 
@@ -12,6 +15,10 @@ Tracklist:
 """
 # Uploaded automatically using https://github.com/pmhalvor/endurabeats/
 
+STREAM_KEYS = ["time", "distance", "heartrate", "moving"]
+STREAMS_CACHE_DIR = os.environ.get("STRAVA_STREAMS_CACHE_DIR", "streams_cache")
+PAUSE_GAP_SECONDS = 30  # paused recordings store no samples, leaving a gap in the time stream
+
 
 def load_tokens(filename):
     with open(filename, 'r') as f:
@@ -38,18 +45,17 @@ def get_activities(access_token):
 def preprocess_activities(raw_activities):
     activities_df = pd.DataFrame(raw_activities)
 
-    # stored in Oslo timezone
+    # stored in UTC, only converted to local time when rendering
     activities_df["start"] = pd.to_datetime(activities_df["start_date"])
 
     # build end_date from start_date and elapsed_time
     activities_df["end"] = activities_df["start"] + pd.to_timedelta(activities_df["elapsed_time"], unit="s")
 
-    # start and end are in UTC, convert to Oslo timezone
-    activities_df["start"] = activities_df["start"].dt.tz_convert("Europe/Oslo")
-    activities_df["end"] = activities_df["end"].dt.tz_convert("Europe/Oslo")
+    # strava timezone looks like "(GMT+01:00) Europe/Oslo", keep the tz name
+    activities_df["timezone"] = activities_df["timezone"].str.split(" ").str[-1].fillna("UTC")
 
     # drop unnecessary columns
-    return activities_df[["athlete", "id", "start", "end"]]
+    return activities_df[["athlete", "id", "start", "end", "timezone"]]
 
 
 def preprocess_tracks(raw_recent_played):
@@ -71,24 +77,150 @@ def preprocess_tracks(raw_recent_played):
     recent_played_df["artist"] = recent_played_df["track"].apply(lambda x: x["artists"][0]["name"])
     recent_played_df["id"] = recent_played_df["track"].apply(lambda x: x["id"])
 
-    # start and end are in UTC, convert to Oslo timezone
-    recent_played_df["start"] = recent_played_df["start"].dt.tz_convert("Europe/Oslo")
-    recent_played_df["end"] = recent_played_df["end"].dt.tz_convert("Europe/Oslo")
-
+    # start and end stay in UTC, only converted to local time when rendering
     # drop unnecessary columns
     return recent_played_df[["start", "end", "track_name", "artist", "id"]].sort_values("start", ascending=True)
 
 
+def to_epoch_ns(timestamps):
+    return timestamps.dt.as_unit("ns").astype("int64").to_numpy()
+
+
+def to_local(timestamp, timezone):
+    return timestamp.tz_convert(timezone)
+
+
 def overlap(x, y, tolerance=dt.timedelta(minutes=3)):
-    return (x.start < y.end + tolerance) & (x.end > y.start - tolerance)
+    # compare as UTC int64 nanoseconds, independent of any display timezone
+    tolerance_ns = tolerance // dt.timedelta(microseconds=1) * 1000
+    return (x.start.value < to_epoch_ns(y["end"]) + tolerance_ns) & (x.end.value > to_epoch_ns(y["start"]) - tolerance_ns)
+
+
+def get_stopped(streams, gap=PAUSE_GAP_SECONDS):
+    # one flag per interval between consecutive samples
+    # moving[k] tells whether the athlete moved between sample k-1 and k
+    if "moving" in streams:
+        return ~streams["moving"].to_numpy(dtype=bool)[1:]
+
+    # without it, only long gaps in the time stream give pauses away
+    return np.diff(streams["time"].to_numpy(dtype="int64")) > gap
+
+
+def get_pauses(streams):
+    time = streams["time"].to_numpy(dtype="int64")
+    stopped = get_stopped(streams)
+
+    # edges of each run of stopped intervals, as sample indices
+    edges = np.diff(np.concatenate([[0], stopped.astype("int8"), [0]]))
+    pause_start = time[np.flatnonzero(edges == 1)]
+    pause_end = time[np.flatnonzero(edges == -1)]
+    return pause_start, pause_end
+
+
+def paused(x, y, streams):
+    # pauses are sorted, disjoint intervals in seconds since activity start
+    pause_start, pause_end = get_pauses(streams)
+    if len(pause_start) == 0:
+        return np.zeros(len(y), dtype=bool)
+
+    start_offset = (to_epoch_ns(y["start"]) - x.start.value) / 1e9
+    end_offset = (to_epoch_ns(y["end"]) - x.start.value) / 1e9
+
+    # the only pause that can contain a track is the last one starting before it
+    idx = np.searchsorted(pause_start, start_offset, side="right") - 1
+    return (idx >= 0) & (end_offset <= pause_end[idx.clip(0)])
 
 
 def build_track_str(x):
     return f"{x.track_name} - {x.artist}"
 
 
-def get_tracklist(x, y):
-    return y[overlap(x, y)].apply(build_track_str, axis=1).to_list()
+def format_pace(seconds_per_km):
+    minutes, seconds = divmod(int(round(seconds_per_km)), 60)
+    return f"{minutes}:{seconds:02d}"
+
+
+def build_split_str(x):
+    details = []
+    if not np.isnan(x.start_km):
+        details.append(f"{x.distance_km:.2f} km at km {x.start_km:.1f}")
+    if not np.isnan(x.pace):
+        details.append(f"{format_pace(x.pace)} /km")
+    if not np.isnan(x.heartrate):
+        details.append(f"{x.heartrate:.0f} bpm")
+    if not details:
+        return build_track_str(x)
+    return f"{build_track_str(x)} ({', '.join(details)})"
+
+
+def get_splits(x, y, streams):
+    # stream samples are seconds since activity start, sorted ascending
+    time = streams["time"].to_numpy(dtype=float)
+    last = len(time) - 1
+
+    # seconds into the activity each track started and ended
+    start_offset = (to_epoch_ns(y["start"]) - x.start.value) / 1e9
+    end_offset = (to_epoch_ns(y["end"]) - x.start.value) / 1e9
+
+    # first sample at/after track start, last sample at/before track end
+    first_idx = np.searchsorted(time, start_offset, side="left").clip(0, last)
+    last_idx = (np.searchsorted(time, end_offset, side="right") - 1).clip(0, last)
+    last_idx = np.maximum(first_idx, last_idx)
+
+    # e.g. strength training with a heart rate strap has no (or only zero) distance
+    if "distance" in streams and streams["distance"].any():
+        distance = streams["distance"].to_numpy(dtype=float)
+    else:
+        distance = np.full(len(time), np.nan)
+
+    # moving time and distance from prefix sums over the same intervals,
+    # so pauses inside a track don't skew its pace
+    stopped = get_stopped(streams)
+    moving_time = np.concatenate([[0.0], np.cumsum(np.where(stopped, 0.0, np.diff(time)))])
+    moving_distance = np.concatenate([[0.0], np.cumsum(np.where(stopped, 0.0, np.diff(distance)))])
+
+    covered = moving_distance[last_idx] - moving_distance[first_idx]
+    duration = moving_time[last_idx] - moving_time[first_idx]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        pace = np.where(covered > 0, duration / covered * 1000, np.nan)
+
+    # average heart rate from prefix sums, so each track costs O(1)
+    # dropped samples are NaN, so sum and count only the valid ones
+    if "heartrate" in streams:
+        samples = streams["heartrate"].to_numpy(dtype=float)
+        heartrate_sum = np.concatenate([[0.0], np.nancumsum(samples)])
+        heartrate_count = np.concatenate([[0], np.cumsum(~np.isnan(samples))])
+        count = heartrate_count[last_idx + 1] - heartrate_count[first_idx]
+        with np.errstate(divide="ignore", invalid="ignore"):
+            heartrate = np.where(count > 0, (heartrate_sum[last_idx + 1] - heartrate_sum[first_idx]) / count, np.nan)
+    else:
+        heartrate = np.full(len(y), np.nan)
+
+    splits = pd.DataFrame(
+        {
+            "start_km": distance[first_idx] / 1000,
+            "end_km": distance[last_idx] / 1000,
+            "distance_km": covered / 1000,
+            "pace": pace,
+            "heartrate": heartrate,
+        },
+        index=y.index,
+    )
+
+    # tracks only matched through the overlap tolerance have no samples of their own
+    outside = (end_offset < time[0]) | (start_offset > time[last])
+    splits[outside] = np.nan
+    return splits
+
+
+def get_tracklist(x, y, streams=None):
+    matches = overlap(x, y)
+    if streams is not None:
+        matches &= ~paused(x, y, streams)
+    tracks = y[matches]
+    if streams is None or tracks.empty:
+        return tracks.apply(build_track_str, axis=1).to_list()
+    return tracks.join(get_splits(x, tracks, streams)).apply(build_split_str, axis=1).to_list()
 
 
 # Update activity with tracklist
@@ -99,6 +231,62 @@ def get_activity(id, access_token):
     return content.json()
 
 
+def get_activity_streams(id, access_token, keys=STREAM_KEYS):
+    URL = f"https://www.strava.com/api/v3/activities/{id}/streams"    # api-endpoint for activity streams
+    HEAD = {"Authorization": f"Bearer {access_token}"}
+    PARAMS = {"keys": ",".join(keys), "key_by_type": "true"}
+    content = r.get(URL, headers=HEAD, params=PARAMS)
+    if content.status_code == 404:   # e.g. manual activities have no streams
+        return None
+    content.raise_for_status()      # rate limits and server errors should be retried next run
+    return content.json()
+
+
+def load_streams(id, access_token, keys=STREAM_KEYS, cache_dir=STREAMS_CACHE_DIR):
+    # streams never change once uploaded, so cache them compressed on disk
+    filename = os.path.join(cache_dir, f"{id}_{'_'.join(keys)}.json.gz")
+    if os.path.exists(filename):
+        with gzip.open(filename, 'rt') as f:
+            return json.load(f)
+
+    raw_streams = get_activity_streams(id, access_token, keys)
+    if not raw_streams or "time" not in raw_streams:
+        return None
+
+    # write to a temp file first, so an interrupted run never leaves a truncated cache
+    os.makedirs(cache_dir, exist_ok=True)
+    fd, tmp_filename = tempfile.mkstemp(dir=cache_dir, suffix=".tmp")
+    os.close(fd)
+    try:
+        with gzip.open(tmp_filename, 'wt') as f:
+            json.dump(raw_streams, f)
+        os.replace(tmp_filename, filename)
+    except BaseException:
+        os.remove(tmp_filename)
+        raise
+    return raw_streams
+
+
+def preprocess_streams(raw_streams):
+    if raw_streams is None:
+        return None
+    return pd.DataFrame({key: stream["data"] for key, stream in raw_streams.items()})
+
+
+def get_activity_tracklist(x, y, access_token):
+    # only spend strava api calls on activities with overlapping tracks
+    if not overlap(x, y).any():
+        return []
+
+    try:
+        streams = preprocess_streams(load_streams(x.id, access_token))
+    except r.HTTPError as e:
+        # skip for now, a plain tracklist would never be replaced by the annotated one
+        print(f"Skipping activity {x.id}, could not load streams: {e}")
+        return []
+    return get_tracklist(x, y, streams)
+
+
 def update_activity(id, data, access_token):
     URL = f"https://www.strava.com/api/v3/activities/{id}"    # api-endpoint for recently played
     HEAD = {"Authorization": f"Bearer {access_token}"}
@@ -144,13 +332,16 @@ if __name__ == '__main__':
 
     # # Get tracklist for each activity
     if not recent_activities.empty:    
-        recent_activities["tracklist"] = recent_activities.apply(get_tracklist, y=tracks, axis=1)
+        recent_activities["tracklist"] = recent_activities.apply(
+            get_activity_tracklist, y=tracks, access_token=strava_tokens["access_token"], axis=1
+        )
 
         # Add tracklist to each activity
         update_description = lambda x: add_tracklist(x.id, x.tracklist, strava_tokens["access_token"])
         recent_activities["descriptions"] = recent_activities.apply(update_description, axis=1)
 
-        # Print updated descriptions
-        print(recent_activities[["id", "descriptions"]])
+        # Print updated descriptions, in each activity's local time
+        recent_activities["local_start"] = recent_activities.apply(lambda x: to_local(x.start, x.timezone), axis=1)
+        print(recent_activities[["id", "local_start", "descriptions"]])
     
     print("Complete.")
\ No newline at end of file